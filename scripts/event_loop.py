@@ -0,0 +1,29 @@
+"""
+Event loop setup shared by the MediaWiki import scripts.
+"""
+
+import sys
+import asyncio
+
+try:
+    import uvloop
+except ImportError:
+    # Optional; the default asyncio event loop is used without it
+    uvloop = None
+
+
+def run(coro):
+    """
+    Run `coro` to completion and return its result.
+    
+    Uses the libuv-based event loop where available. On Python 3.11+ the
+    loop is passed to asyncio.Runner directly; the event loop policy API
+    is only used on older versions, as it is deprecated from 3.14.
+    """
+    if uvloop is None:
+        return asyncio.run(coro)
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(coro)
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coro)
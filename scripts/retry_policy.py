@@ -0,0 +1,38 @@
+"""
+Retry policy shared by the MediaWiki import scripts.
+"""
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Retries for transient server errors. A Retry-After header on the
+# response overrides the exponential backoff, up to RETRY_AFTER_MAX seconds
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.5
+RETRY_AFTER_MAX = 120
+# Statuses retried for idempotent requests (GETs and read-only API POSTs)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses that mean the request was not processed, so even a
+# non-idempotent POST is safe to send again
+RETRY_STATUSES_UNPROCESSED = {429, 503}
+
+
+def retry_delay(retry_after: str, attempt: int) -> float:
+    """
+    Return how long to wait before retry number `attempt` (from 0).
+    
+    Honors a Retry-After value given in seconds or as an HTTP date, and
+    falls back to exponential backoff without one.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after)
+                delay = (when - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), RETRY_AFTER_MAX)
+    return RETRY_BACKOFF * 2 ** attempt
@@ -8,6 +8,9 @@ import os
 import sys
 import re
 import argparse
+import asyncio
+import itertools
+import json
 from pathlib import Path
 from datetime import datetime
 
@@ -17,45 +20,394 @@ except ImportError:
     print("Error: mwclient is required. Install with: pip install mwclient")
     sys.exit(1)
 
+try:
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    print("Error: requests and urllib3 are required. Install with: pip install requests urllib3")
+    sys.exit(1)
+
+try:
+    import aiohttp
+except ImportError:
+    print("Error: aiohttp is required. Install with: pip install aiohttp")
+    sys.exit(1)
+
 try:
     from dotenv import load_dotenv
 except ImportError:
     print("Warning: python-dotenv not installed. Using environment variables only.")
     load_dotenv = None
 
+import event_loop
+from retry_policy import (
+    RETRY_TOTAL,
+    RETRY_BACKOFF,
+    RETRY_AFTER_MAX,
+    RETRY_STATUSES,
+    retry_delay
+)
+
+# Records the revision ID each exported page was saved at, keyed by title
+MANIFEST_NAME = '.revisions.json'
+
+# Titles per content query: the API's limit for ordinary accounts, and
+# for accounts with the apihighlimits right
+BATCH_SIZE = 50
+BATCH_SIZE_HIGH_LIMITS = 500
+# Batch size adaptation: shrink on rejection, regrow after a streak of
+# successful batches
+BATCH_SHRINK = 0.8
+BATCH_GROW = 1.1
+BATCH_GROW_AFTER = 10
+
+# Finds the limit in the API's toomanyvalues error message
+_LIMIT_RE = re.compile(r'limit is (\d+)')
+
+# Characters that are unsafe in filenames, plus whitespace
+_UNSAFE_FILENAME_RE = re.compile(r'[<>:"/\\|?*\s]+')
+# Older exports replaced each unsafe character separately, then each
+# run of whitespace
+_LEGACY_UNSAFE_RE = re.compile(r'[<>:"/\\|?*]')
+_LEGACY_WHITESPACE_RE = re.compile(r'\s+')
+
 
 def sanitize_filename(title: str) -> str:
     """Convert wiki page title to a safe filename."""
-    # Replace problematic characters
-    safe_name = re.sub(r'[<>:"/\\|?*]', '_', title)
-    safe_name = re.sub(r'\s+', '_', safe_name)
-    safe_name = safe_name.strip('._')
-    # Limit length
-    if len(safe_name) > 200:
-        safe_name = safe_name[:200]
-    return safe_name
-
-
-def get_page_content(page) -> str:
-    """Extract content from a MediaWiki page."""
+    # Replace each run of problematic characters or whitespace, then
+    # limit length
+    return _UNSAFE_FILENAME_RE.sub('_', title).strip('._')[:200]
+
+
+def legacy_filename(title: str) -> str:
+    """Return the filename older exports used for a wiki page title."""
+    safe_name = _LEGACY_WHITESPACE_RE.sub('_', _LEGACY_UNSAFE_RE.sub('_', title))
+    return safe_name.strip('._')[:200] + ".txt"
+
+
+def remove_legacy_file(filepath: Path, title: str):
+    """
+    Remove a page exported under its old filename.
+    
+    Only deletes the file if its heading names `title`, so a different
+    page that now maps to the same name is left alone.
+    """
     try:
-        # Get the raw wikitext content
-        text = page.text()
-        
-        # Create a formatted document
-        content = f"""# {page.name}
+        with open(filepath, 'r', encoding='utf-8') as f:
+            heading = f.readline()
+        if heading.rstrip('\n') == f"# {title}":
+            filepath.unlink()
+            print(f"  Removed old export: {filepath.name}")
+    except (OSError, UnicodeDecodeError):
+        pass
+
+
+def get_page_content(title: str, text: str, touched: str = None) -> str:
+    """Format the wikitext of a MediaWiki page as an export document."""
+    if text is None:
+        print(f"  Warning: Could not get content for '{title}'")
+        return None
+    
+    # Create a formatted document
+    content = f"""# {title}
 
 {text}
 
 ---
 Source: MediaWiki
-Page: {page.name}
-Last Modified: {page.touched if hasattr(page, 'touched') else 'Unknown'}
+Page: {title}
+Last Modified: {touched or 'Unknown'}
 """
-        return content
-    except Exception as e:
-        print(f"  Warning: Could not get content for '{page.name}': {e}")
-        return None
+    return content
+
+
+def batched(iterable, size: int):
+    """Yield successive tuples of at most `size` items from an iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = tuple(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_manifest(manifest_path: Path) -> dict:
+    """Load the export manifest, or an empty one if missing or unreadable."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_path: Path, manifest: dict):
+    """Write the export manifest."""
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def save_page(filepath: Path, content: str):
+    """Write an exported page to disk."""
+    # Encode once and write the bytes unbuffered, skipping the text-mode
+    # file object and its encoder
+    data = memoryview(content.encode('utf-8'))
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+
+class BatchTooLargeError(Exception):
+    """
+    The API rejected a query for having too many titles.
+    
+    `limit` is the maximum the server reported, if it said.
+    """
+    
+    def __init__(self, message: str, limit: int = None):
+        super().__init__(message)
+        self.limit = limit
+
+
+class BatchSizer:
+    """
+    Tracks how many titles to send per content query.
+    
+    Starts at the largest size the server should accept. A rejected batch
+    caps the size for the rest of the run: at the limit the server
+    reported, or else below the rejected size, with the size lowered to
+    BATCH_SHRINK of the rejected size. The size grows back by
+    BATCH_GROW after BATCH_GROW_AFTER successful batches in a row, never
+    above the cap. Shrinking is based on the rejected size rather than
+    the current one, so concurrent rejections of the same size only
+    shrink it once.
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = max_size
+        self._streak = 0
+    
+    def shrink(self, rejected_size: int, limit: int = None):
+        if limit:
+            self.max_size = max(1, min(self.max_size, limit))
+            self.size = min(self.size, self.max_size)
+        else:
+            self.max_size = max(1, min(self.max_size, rejected_size - 1))
+            self.size = min(self.size, self.max_size, max(1, int(rejected_size * BATCH_SHRINK)))
+        self._streak = 0
+    
+    def succeeded(self):
+        self._streak += 1
+        if self._streak >= BATCH_GROW_AFTER and self.size < self.max_size:
+            self.size = min(self.max_size, max(self.size + 1, int(self.size * BATCH_GROW)))
+            self._streak = 0
+
+
+class CappedRetry(Retry):
+    """urllib3 Retry that waits at most RETRY_AFTER_MAX for Retry-After."""
+    
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+
+async def api_post(session: aiohttp.ClientSession, api_url: str, params: dict) -> dict:
+    """
+    POST an API request and return the decoded result.
+    
+    Only read-only queries are sent this way, so connection errors and
+    RETRY_STATUSES responses are retried up to RETRY_TOTAL times, waiting
+    as long as the server's Retry-After header asks or else with
+    exponential backoff. Raises BatchTooLargeError on HTTP 413/414.
+    """
+    for attempt in range(RETRY_TOTAL + 1):
+        retry_after = None
+        try:
+            async with session.post(api_url, data=params) as resp:
+                if resp.status not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+                    if resp.status in (413, 414):
+                        raise BatchTooLargeError(f"HTTP {resp.status}")
+                    resp.raise_for_status()
+                    return await resp.json()
+                retry_after = resp.headers.get('Retry-After')
+        except aiohttp.ClientConnectionError:
+            if attempt == RETRY_TOTAL:
+                raise
+        await asyncio.sleep(retry_delay(retry_after, attempt))
+
+
+async def fetch_batch(session: aiohttp.ClientSession, api_url: str, titles) -> list:
+    """
+    Fetch the wikitext of several pages with a single API query.
+    
+    Follows `continue` tokens when the API truncates the response, and
+    returns a list of (title, text, touched) tuples in request order.
+    Raises BatchTooLargeError if the server refuses that many titles.
+    """
+    params = {
+        'action': 'query',
+        'prop': 'revisions',
+        'rvprop': 'content|timestamp',
+        'rvslots': 'main',
+        'titles': '|'.join(titles),
+        'format': 'json',
+        'formatversion': 2,
+    }
+    found = {}
+    
+    while True:
+        result = await api_post(session, api_url, params)
+        
+        if 'error' in result:
+            error = result['error']
+            if error.get('code') == 'toomanyvalues':
+                # e.g. 'Too many values supplied for parameter "titles".
+                # The limit is 50.'
+                match = _LIMIT_RE.search(error.get('info', ''))
+                raise BatchTooLargeError(error.get('info'), int(match.group(1)) if match else None)
+            raise RuntimeError(f"{error.get('code')}: {error.get('info')}")
+        
+        for page in result.get('query', {}).get('pages', []):
+            revisions = page.get('revisions')
+            if not revisions:
+                continue
+            revision = revisions[0]
+            text = revision.get('slots', {}).get('main', {}).get('content')
+            found[page['title']] = (text, revision.get('timestamp'))
+        
+        if 'continue' not in result:
+            break
+        params.update(result['continue'])
+    
+    return [(title, *found.get(title, (None, None))) for title in titles]
+
+
+async def export_pages(
+    site,
+    api_url: str,
+    titles,
+    output_path: Path,
+    concurrency: int = 10,
+    on_saved=None
+) -> tuple:
+    """
+    Fetch and save pages in batches, with up to `concurrency` API
+    queries in flight at once.
+    
+    Batches start at the largest size the account may request and adapt
+    to what the server accepts (see BatchSizer). Reuses the mwclient
+    session's cookies and User-Agent so that a prior login still applies.
+    `on_saved(title)` is called after each page is written. Returns
+    (exported_count, error_count).
+    """
+    exported_count = 0
+    error_count = 0
+    loop = asyncio.get_running_loop()
+    titles = iter(titles)
+    rights = getattr(site, 'rights', None) or ()
+    sizer = BatchSizer(BATCH_SIZE_HIGH_LIMITS if 'apihighlimits' in rights else BATCH_SIZE)
+    
+    async def fetch_adaptive(chunk) -> tuple:
+        # Split the chunk into smaller batches for as long as the server
+        # rejects them. Parts are re-split before sending if another
+        # worker has shrunk the size in the meantime. A part that fails
+        # otherwise only costs its own titles; returns (batch, failed).
+        pending = [chunk]
+        batch = []
+        failed = 0
+        while pending:
+            part = pending.pop()
+            if len(part) > sizer.size:
+                pending.extend(reversed(list(batched(part, sizer.size))))
+                continue
+            try:
+                batch.extend(await fetch_batch(session, api_url, part))
+                sizer.succeeded()
+            except BatchTooLargeError as e:
+                if len(part) > 1:
+                    sizer.shrink(len(part), e.limit)
+                    print(f"  Batch of {len(part)} titles rejected ({e}); retrying with {sizer.size}")
+                    pending.extend(reversed(list(batched(part, min(sizer.size, len(part) - 1)))))
+                    continue
+                print(f"  Error fetching '{part[0]}': {e}")
+                failed += 1
+            except Exception as e:
+                print(f"  Error fetching batch of {len(part)} starting at '{part[0]}': {e}")
+                failed += len(part)
+        return batch, failed
+    
+    async def export_batch(chunk):
+        nonlocal exported_count, error_count
+        batch, failed = await fetch_adaptive(chunk)
+        error_count += failed
+        
+        for title, text, touched in batch:
+            try:
+                print(f"[{exported_count + error_count + 1}] Exporting: {title}")
+                
+                # Get page content
+                content = get_page_content(title, text, touched)
+                if content is None:
+                    error_count += 1
+                    continue
+                
+                # Save to file off the event loop
+                filename = sanitize_filename(title) + ".txt"
+                await loop.run_in_executor(None, save_page, output_path / filename, content)
+                
+                # Drop the copy saved under the pre-collapse filename, so
+                # it is not uploaded alongside the new one
+                old_filename = legacy_filename(title)
+                if old_filename != filename:
+                    await loop.run_in_executor(
+                        None, remove_legacy_file, output_path / old_filename, title
+                    )
+                
+                exported_count += 1
+                if on_saved:
+                    on_saved(title)
+                
+            except Exception as e:
+                print(f"  Error processing page: {e}")
+                error_count += 1
+    
+    cookies = {cookie.name: cookie.value for cookie in site.connection.cookies}
+    headers = {
+        'User-Agent': site.connection.headers.get('User-Agent', 'mwclient'),
+        'Accept-Encoding': 'gzip, deflate'
+    }
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    
+    # Iterating the titles drives mwclient's blocking listing requests
+    # (including urllib3's Retry-After sleeps), so pull chunks in the
+    # executor. The lock keeps one thread at a time in the generator.
+    listing_lock = asyncio.Lock()
+    
+    def take_titles(size: int) -> tuple:
+        return tuple(itertools.islice(titles, size))
+    
+    async def next_chunk() -> tuple:
+        async with listing_lock:
+            return await loop.run_in_executor(None, take_titles, sizer.size)
+    
+    async def worker():
+        # Each worker takes the next batch at the current size, so
+        # size changes apply to every batch not yet started
+        while True:
+            chunk = await next_chunk()
+            if not chunk:
+                return
+            await export_batch(chunk)
+    
+    async with aiohttp.ClientSession(connector=connector, cookies=cookies, headers=headers) as session:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    
+    return exported_count, error_count
 
 
 def scrape_mediawiki(
@@ -65,7 +417,8 @@ def scrape_mediawiki(
     username: str = None,
     password: str = None,
     namespace: int = 0,  # 0 = Main namespace
-    limit: int = None
+    limit: int = None,
+    concurrency: int = 10
 ):
     """
     Scrape all pages from a MediaWiki instance.
@@ -78,6 +431,7 @@ def scrape_mediawiki(
         password: Optional password for authentication
         namespace: MediaWiki namespace to scrape (0 = main articles)
         limit: Maximum number of pages to scrape (None = all)
+        concurrency: Maximum number of API queries in flight at once
     """
     print(f"Connecting to MediaWiki at {wiki_url}...")
     
@@ -89,6 +443,8 @@ def scrape_mediawiki(
     elif wiki_url.startswith('https://'):
         wiki_url = wiki_url.replace('https://', '')
     
+    # mwclient keeps its own session, which sets a descriptive User-Agent
+    # and already asks for gzip-compressed responses
     try:
         site = mwclient.Site(wiki_url, path=wiki_path, scheme=scheme)
         print(f"Connected successfully to {wiki_url}")
@@ -96,6 +452,24 @@ def scrape_mediawiki(
         print(f"Error connecting to MediaWiki: {e}")
         sys.exit(1)
     
+    # mwclient already retries its own requests (login as a POST, the
+    # page listing as a GET) on 5xx and connection errors, but raises on
+    # 429. Have urllib3 retry just that, for any method, honoring
+    # Retry-After; 429 means the request was not processed
+    retry = CappedRetry(
+        total=RETRY_TOTAL,
+        connect=0,
+        read=0,
+        other=0,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=[429],
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    site.connection.mount('https://', HTTPAdapter(max_retries=retry))
+    site.connection.mount('http://', HTTPAdapter(max_retries=retry))
+    
     # Login if credentials provided
     if username and password:
         try:
@@ -112,43 +486,58 @@ def scrape_mediawiki(
     
     # Get all pages
     print(f"\nFetching pages from namespace {namespace}...")
-    pages = site.allpages(namespace=namespace)
+    # limit is the per-request listing size: 'max' lets the server send
+    # up to 5000 titles per request for accounts with apihighlimits
+    pages = site.allpages(namespace=namespace, limit='max')
     
-    exported_count = 0
-    error_count = 0
+    if limit:
+        pages = itertools.islice(pages, limit)
     
-    for i, page in enumerate(pages):
-        if limit and i >= limit:
-            print(f"\nReached limit of {limit} pages.")
-            break
-        
-        try:
+    # Skip pages whose latest revision was already exported. The listing
+    # carries each page's lastrevid, which serves as an ETag: content is
+    # only requested for titles that have a new revision. (api.php does
+    # not answer If-Modified-Since with 304 for action=query, and
+    # page_touched also changes on cache purges that leave the wikitext
+    # as it was.)
+    manifest_path = output_path / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    revision_by_title = {}
+    listed_count = 0
+    skipped_count = 0
+    
+    def changed_titles():
+        nonlocal listed_count, skipped_count
+        for page in pages:
+            listed_count += 1
             title = page.name
-            print(f"[{i+1}] Exporting: {title}")
-            
-            # Get page content
-            content = get_page_content(page)
-            if content is None:
-                error_count += 1
+            revision = getattr(page, 'revision', None)
+            filepath = output_path / (sanitize_filename(title) + ".txt")
+            if revision and manifest.get(title) == revision and filepath.exists():
+                skipped_count += 1
                 continue
-            
-            # Save to file
-            filename = sanitize_filename(title) + ".txt"
-            filepath = output_path / filename
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
-            
-            exported_count += 1
-            
-        except Exception as e:
-            print(f"  Error processing page: {e}")
-            error_count += 1
+            revision_by_title[title] = revision
+            yield title
+    
+    def record_export(title):
+        if revision_by_title.get(title):
+            manifest[title] = revision_by_title[title]
+    
+    api_url = f"{scheme}://{wiki_url}{wiki_path}api.php"
+    try:
+        exported_count, error_count = event_loop.run(
+            export_pages(site, api_url, changed_titles(), output_path, concurrency, record_export)
+        )
+    finally:
+        save_manifest(manifest_path, manifest)
+    
+    if limit and listed_count >= limit:
+        print(f"\nReached limit of {limit} pages.")
     
     # Summary
     print(f"\n{'='*50}")
     print(f"Export Complete!")
     print(f"  - Pages exported: {exported_count}")
+    print(f"  - Pages unchanged: {skipped_count}")
     print(f"  - Errors: {error_count}")
     print(f"  - Output directory: {output_path.absolute()}")
     print(f"{'='*50}")
@@ -197,6 +586,12 @@ def main():
         default=None,
         help='Maximum number of pages to export'
     )
+    parser.add_argument(
+        '--concurrency', '-c',
+        type=int,
+        default=10,
+        help='Maximum number of concurrent API requests (default: 10)'
+    )
     
     args = parser.parse_args()
     
@@ -212,7 +607,8 @@ def main():
         username=args.username,
         password=args.password,
         namespace=args.namespace,
-        limit=args.limit
+        limit=args.limit,
+        concurrency=args.concurrency
     )
 
 
@@ -7,13 +7,15 @@ Uploads documents to AnythingLLM and embeds them in a workspace.
 import os
 import sys
 import argparse
-import time
+import asyncio
+import hashlib
+import json
 from pathlib import Path
 
 try:
-    import requests
+    import aiohttp
 except ImportError:
-    print("Error: requests is required. Install with: pip install requests")
+    print("Error: aiohttp is required. Install with: pip install aiohttp")
     sys.exit(1)
 
 try:
@@ -22,187 +24,491 @@ except ImportError:
     print("Warning: python-dotenv not installed. Using environment variables only.")
     load_dotenv = None
 
+import event_loop
+from retry_policy import (
+    RETRY_TOTAL,
+    RETRY_STATUSES,
+    RETRY_STATUSES_UNPROCESSED,
+    retry_delay
+)
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    # Optional; fall back to the standard library
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+    json_loads = json.loads
+
+
+# Extra headers for requests with a JSON body
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Number of documents embedded per update-embeddings call, and how many
+# seconds to wait for a batch to fill before sending it anyway
+EMBED_BATCH_SIZE = 50
+EMBED_LINGER = 10
+
+# Supported file extensions
+SUPPORTED_EXTENSIONS = {'.txt', '.md', '.pdf', '.docx', '.doc', '.html', '.htm'}
+
+# Records the content hash of each embedded document, keyed by
+# workspace slug and then filename
+MANIFEST_NAME = '.uploaded.json'
+
+# Workspace slugs resolved by earlier runs, keyed by "<base_url>|<name>"
+SLUG_CACHE_PATH = Path.home() / '.cache' / 'anythingllm' / 'slugs.json'
+
+# In-memory copy of SLUG_CACHE_PATH, loaded on first use
+_workspace_slugs = None
+
+
+class WorkspaceNotFoundError(Exception):
+    """The server rejected a workspace slug (HTTP 400/404)."""
+
 
 class AnythingLLMClient:
-    """Client for AnythingLLM API."""
+    """
+    Async client for AnythingLLM API.
     
-    def __init__(self, base_url: str, api_key: str):
+    Holds one pooled aiohttp session so every call reuses keep-alive
+    connections to the server. Use as an async context manager to close
+    the session when done.
+    """
+    
+    def __init__(self, base_url: str, api_key: str, pool_size: int = 20):
         self.base_url = base_url.rstrip('/')
         self.api_key = api_key
         self.headers = {
             'Authorization': f'Bearer {api_key}',
-            'Accept': 'application/json'
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate'
         }
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size),
+            headers=self.headers
+        )
+        
+        # Endpoint URLs, built once rather than on every call
+        self._ping_url = f'{self.base_url}/api/ping'
+        self._workspaces_url = f'{self.base_url}/api/v1/workspaces'
+        self._new_workspace_url = f'{self.base_url}/api/v1/workspace/new'
+        self._upload_url = f'{self.base_url}/api/v1/document/upload'
+        self._embed_url = f'{self.base_url}/api/v1/workspace/{{slug}}/update-embeddings'
+        self._embed_urls = {}
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def close(self):
+        """Close the underlying HTTP session."""
+        await self.session.close()
+    
+    def _embed_url_for(self, workspace_slug: str) -> str:
+        """Return the update-embeddings URL for a workspace."""
+        url = self._embed_urls.get(workspace_slug)
+        if url is None:
+            url = self._embed_urls[workspace_slug] = self._embed_url.format(slug=workspace_slug)
+        return url
     
-    def ping(self) -> bool:
+    async def _request(self, method: str, url: str, timeout: int, make_data=None, **kwargs) -> dict:
+        """
+        Send a request and return the decoded JSON response.
+        
+        Connection errors and RETRY_STATUSES responses are retried up to
+        RETRY_TOTAL times, waiting as long as the server's Retry-After
+        header asks or else with exponential backoff. `make_data` builds a
+        fresh request body for each attempt, since a consumed body cannot
+        be sent twice. A `json` body is serialized once up front.
+        """
+        if 'json' in kwargs:
+            kwargs['data'] = json_dumps(kwargs.pop('json'))
+            kwargs['headers'] = JSON_HEADERS
+        retry_statuses = RETRY_STATUSES if method == 'GET' else RETRY_STATUSES_UNPROCESSED
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        
+        for attempt in range(RETRY_TOTAL + 1):
+            if make_data is not None:
+                kwargs['data'] = make_data()
+            retry_after = None
+            try:
+                async with self.session.request(
+                    method,
+                    url,
+                    timeout=client_timeout,
+                    **kwargs
+                ) as resp:
+                    if resp.status not in retry_statuses or attempt == RETRY_TOTAL:
+                        resp.raise_for_status()
+                        return json_loads(await resp.read())
+                    retry_after = resp.headers.get('Retry-After')
+            except aiohttp.ClientConnectionError:
+                if attempt == RETRY_TOTAL:
+                    raise
+            await asyncio.sleep(retry_delay(retry_after, attempt))
+    
+    async def ping(self) -> bool:
         """Check if AnythingLLM is reachable."""
         try:
-            resp = requests.get(f'{self.base_url}/api/ping', timeout=10)
-            return resp.status_code == 200
+            async with self.session.get(
+                self._ping_url,
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as resp:
+                return resp.status == 200
         except Exception as e:
             print(f"Ping failed: {e}")
             return False
     
-    def get_workspaces(self) -> list:
+    async def get_workspaces(self) -> list:
         """Get all workspaces."""
         try:
-            resp = requests.get(
-                f'{self.base_url}/api/v1/workspaces',
-                headers=self.headers,
-                timeout=30
-            )
-            resp.raise_for_status()
-            return resp.json().get('workspaces', [])
+            result = await self._request('GET', self._workspaces_url, timeout=30)
+            return result.get('workspaces', [])
         except Exception as e:
             print(f"Error getting workspaces: {e}")
             return []
     
-    def create_workspace(self, name: str) -> dict:
+    async def resolve_workspace_slug(self, name: str) -> str:
+        """
+        Return the slug of the workspace called `name`, or None if it
+        does not exist.
+        
+        Results are cached in memory and in SLUG_CACHE_PATH, so repeated
+        runs skip the workspace listing; the server is queried on a miss.
+        A cached slug is trusted as is; if the server later rejects it,
+        forget_workspace_slug() and resolve again.
+        """
+        slug = self.cached_workspace_slug(name)
+        if slug:
+            return slug
+        
+        workspaces = {ws.get('name'): ws for ws in await self.get_workspaces()}
+        slug = workspaces.get(name, {}).get('slug')
+        
+        if slug:
+            self.remember_workspace_slug(name, slug)
+        return slug
+    
+    def cached_workspace_slug(self, name: str) -> str:
+        """Return the cached slug of the workspace called `name`, if any."""
+        return workspace_slug_cache().get(f'{self.base_url}|{name}')
+    
+    def remember_workspace_slug(self, name: str, slug: str):
+        """Cache the slug of the workspace called `name`."""
+        workspace_slug_cache()[f'{self.base_url}|{name}'] = slug
+        save_workspace_slug_cache()
+    
+    def forget_workspace_slug(self, name: str):
+        """Drop a cached workspace slug, e.g. after it stopped working."""
+        if workspace_slug_cache().pop(f'{self.base_url}|{name}', None):
+            save_workspace_slug_cache()
+    
+    async def create_workspace(self, name: str) -> dict:
         """Create a new workspace."""
         try:
-            resp = requests.post(
-                f'{self.base_url}/api/v1/workspace/new',
-                headers=self.headers,
-                json={'name': name},
-                timeout=30
+            result = await self._request(
+                'POST', self._new_workspace_url,
+                timeout=30,
+                json={'name': name}
             )
-            resp.raise_for_status()
-            return resp.json().get('workspace', {})
+            return result.get('workspace', {})
         except Exception as e:
             print(f"Error creating workspace: {e}")
             return {}
     
-    def upload_document(self, file_path: Path) -> dict:
+    async def upload_document(self, file_path: Path) -> dict:
         """Upload a document to AnythingLLM."""
+        def make_form():
+            # Pass the open file rather than its bytes: aiohttp streams it
+            # into the socket in 64 KiB chunks read off the event loop,
+            # and closes it once the body has been written.
+            form = aiohttp.FormData()
+            form.add_field(
+                'file',
+                open(file_path, 'rb'),
+                filename=file_path.name,
+                content_type='text/plain'
+            )
+            return form
+        
         try:
-            with open(file_path, 'rb') as f:
-                files = {'file': (file_path.name, f, 'text/plain')}
-                resp = requests.post(
-                    f'{self.base_url}/api/v1/document/upload',
-                    headers={'Authorization': f'Bearer {self.api_key}'},
-                    files=files,
-                    timeout=60
-                )
-            resp.raise_for_status()
-            return resp.json()
+            return await self._request(
+                'POST', self._upload_url,
+                timeout=60,
+                make_data=make_form
+            )
         except Exception as e:
             print(f"Error uploading {file_path.name}: {e}")
             return {}
     
-    def add_document_to_workspace(self, workspace_slug: str, document_location: str) -> bool:
-        """Add an uploaded document to a workspace for embedding."""
+    async def add_documents_to_workspace(self, workspace_slug: str, document_locations: list) -> bool:
+        """
+        Add uploaded documents to a workspace for embedding.
+        
+        Raises WorkspaceNotFoundError if the server rejects the slug.
+        """
         try:
-            resp = requests.post(
-                f'{self.base_url}/api/v1/workspace/{workspace_slug}/update-embeddings',
-                headers=self.headers,
-                json={'adds': [document_location], 'deletes': []},
-                timeout=120
+            await self._request(
+                'POST', self._embed_url_for(workspace_slug),
+                timeout=600,
+                json={'adds': list(document_locations), 'deletes': []}
             )
-            resp.raise_for_status()
             return True
+        except aiohttp.ClientResponseError as e:
+            if e.status in (400, 404):
+                raise WorkspaceNotFoundError(f"{e.status} {e.message}") from e
+            print(f"Error adding documents to workspace: {e}")
+            return False
         except Exception as e:
-            print(f"Error adding document to workspace: {e}")
+            print(f"Error adding documents to workspace: {e}")
             return False
 
 
-def upload_documents(
+def file_digest(file_path: Path) -> str:
+    """Return a BLAKE2b content hash of a file, read in 1 MiB chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_json(path: Path) -> dict:
+    """Load a JSON object from a file, or an empty dict if missing or unreadable."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_json(path: Path, data: dict):
+    """Write a JSON object to a file, creating its directory if needed."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+
+
+def workspace_slug_cache() -> dict:
+    """Return the workspace slug cache, loading it from disk on first use."""
+    global _workspace_slugs
+    if _workspace_slugs is None:
+        _workspace_slugs = load_json(SLUG_CACHE_PATH)
+    return _workspace_slugs
+
+
+def save_workspace_slug_cache():
+    """Persist the workspace slug cache; failures only cost a lookup later."""
+    try:
+        save_json(SLUG_CACHE_PATH, workspace_slug_cache())
+    except OSError as e:
+        print(f"Warning: Could not save workspace cache: {e}")
+
+
+async def _upload_documents(
     anythingllm_url: str,
     api_key: str,
     documents_dir: str,
-    workspace_name: str = "MediaWiki Import"
+    workspace_name: str,
+    concurrency: int
 ):
-    """
-    Upload documents to AnythingLLM and embed them in a workspace.
-    
-    Args:
-        anythingllm_url: AnythingLLM server URL
-        api_key: API key for authentication
-        documents_dir: Directory containing documents to upload
-        workspace_name: Name of the workspace to use/create
-    """
+    """Async implementation of upload_documents()."""
     print(f"Connecting to AnythingLLM at {anythingllm_url}...")
     
-    client = AnythingLLMClient(anythingllm_url, api_key)
-    
-    # Check connection
-    if not client.ping():
-        print("Error: Cannot connect to AnythingLLM. Is it running?")
-        sys.exit(1)
-    print("Connected successfully!")
-    
-    # Find or create workspace
-    print(f"\nLooking for workspace '{workspace_name}'...")
-    workspaces = client.get_workspaces()
-    workspace = None
-    
-    for ws in workspaces:
-        if ws.get('name') == workspace_name:
-            workspace = ws
-            break
-    
-    if workspace:
-        print(f"Found existing workspace: {workspace_name}")
-    else:
-        print(f"Creating new workspace: {workspace_name}")
-        workspace = client.create_workspace(workspace_name)
-        if not workspace:
-            print("Error: Failed to create workspace")
+    async with AnythingLLMClient(anythingllm_url, api_key) as client:
+        # Check connection
+        if not await client.ping():
+            print("Error: Cannot connect to AnythingLLM. Is it running?")
             sys.exit(1)
-    
-    workspace_slug = workspace.get('slug')
-    print(f"Workspace slug: {workspace_slug}")
-    
-    # Get documents to upload
-    docs_path = Path(documents_dir)
-    if not docs_path.exists():
-        print(f"Error: Documents directory not found: {docs_path}")
-        sys.exit(1)
-    
-    # Supported file extensions
-    extensions = {'.txt', '.md', '.pdf', '.docx', '.doc', '.html', '.htm'}
-    files = [f for f in docs_path.iterdir() if f.is_file() and f.suffix.lower() in extensions]
-    
-    if not files:
-        print(f"No documents found in {docs_path}")
-        sys.exit(1)
-    
-    print(f"\nFound {len(files)} documents to upload")
-    
-    # Upload documents
-    uploaded = 0
-    embedded = 0
-    
-    for i, file_path in enumerate(files, 1):
-        print(f"\n[{i}/{len(files)}] Uploading: {file_path.name}")
+        print("Connected successfully!")
         
-        result = client.upload_document(file_path)
-        if not result:
-            continue
+        async def find_or_create_workspace() -> str:
+            print(f"\nLooking for workspace '{workspace_name}'...")
+            slug = await client.resolve_workspace_slug(workspace_name)
+            
+            if slug:
+                print(f"Found existing workspace: {workspace_name}")
+            else:
+                print(f"Creating new workspace: {workspace_name}")
+                workspace = await client.create_workspace(workspace_name)
+                if not workspace:
+                    print("Error: Failed to create workspace")
+                    sys.exit(1)
+                slug = workspace.get('slug')
+                client.remember_workspace_slug(workspace_name, slug)
+            
+            print(f"Workspace slug: {slug}")
+            return slug
         
-        uploaded += 1
+        # Find or create workspace. A cached slug is only re-checked if
+        # embedding reports it missing (see embed() below).
+        slug_from_cache = client.cached_workspace_slug(workspace_name) is not None
+        workspace_slug = await find_or_create_workspace()
         
-        # Get the document location for embedding
-        doc_location = result.get('documents', [{}])[0].get('location')
-        if doc_location:
-            print(f"  Embedding document...")
-            if client.add_document_to_workspace(workspace_slug, doc_location):
-                embedded += 1
-                print(f"  ✓ Embedded successfully")
-            else:
-                print(f"  ✗ Embedding failed")
+        # Get documents to upload
+        docs_path = Path(documents_dir)
+        if not docs_path.exists():
+            print(f"Error: Documents directory not found: {docs_path}")
+            sys.exit(1)
+        
+        # Check the extension before is_file(), which uses the cached
+        # directory entry type and avoids a stat() per file
+        with os.scandir(docs_path) as entries:
+            files = [
+                Path(entry.path) for entry in entries
+                if os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+                and entry.is_file(follow_symlinks=False)
+            ]
+        
+        if not files:
+            print(f"No documents found in {docs_path}")
+            sys.exit(1)
+        
+        print(f"\nFound {len(files)} documents to upload")
+        
+        # Bound the number of files in flight; this replaces the fixed
+        # pause between uploads as the rate limit.
+        semaphore = asyncio.Semaphore(concurrency)
         
-        # Rate limiting - brief pause between uploads
-        time.sleep(0.5)
+        # Files whose hash matches the manifest were embedded by a
+        # previous run and are skipped
+        manifest_path = docs_path / MANIFEST_NAME
+        manifest = load_json(manifest_path)
+        embedded_hashes = manifest.setdefault(workspace_slug, {})
+        loop = asyncio.get_running_loop()
+        
+        # Uploads feed document locations into a queue while a single
+        # consumer embeds them, so embedding overlaps with later uploads.
+        # A batch is sent once it holds EMBED_BATCH_SIZE documents, its
+        # first document has waited EMBED_LINGER seconds, or uploads are
+        # done. None marks the end of uploads.
+        queue = asyncio.Queue()
+        uploaded = 0
+        embedded = 0
+        skipped = 0
+        
+        async def upload(i: int, file_path: Path):
+            nonlocal uploaded, skipped
+            async with semaphore:
+                digest = await loop.run_in_executor(None, file_digest, file_path)
+                if embedded_hashes.get(file_path.name) == digest:
+                    skipped += 1
+                    return
+                
+                print(f"[{i}/{len(files)}] Uploading: {file_path.name}")
+                
+                result = await client.upload_document(file_path)
+                if not result:
+                    return
+                uploaded += 1
+                
+                # Get the document location for embedding
+                doc_location = result.get('documents', [{}])[0].get('location')
+                if doc_location:
+                    await queue.put((doc_location, file_path.name, digest))
+        
+        async def produce():
+            try:
+                await asyncio.gather(
+                    *(upload(i, f) for i, f in enumerate(files, 1))
+                )
+            finally:
+                await queue.put(None)
+        
+        async def embed(locations: list) -> bool:
+            nonlocal workspace_slug, embedded_hashes, slug_from_cache
+            try:
+                return await client.add_documents_to_workspace(workspace_slug, locations)
+            except WorkspaceNotFoundError as e:
+                if not slug_from_cache:
+                    print(f"Error adding documents to workspace: {e}")
+                    return False
+                print(f"  Cached workspace slug '{workspace_slug}' was rejected ({e})")
+            
+            # The cached slug is stale: resolve it once from the server and
+            # retry this batch against the workspace found or created
+            slug_from_cache = False
+            client.forget_workspace_slug(workspace_name)
+            workspace_slug = await find_or_create_workspace()
+            embedded_hashes = manifest.setdefault(workspace_slug, {})
+            return await embed(locations)
+        
+        async def consume():
+            nonlocal embedded
+            finished = False
+            while not finished:
+                item = await queue.get()
+                deadline = loop.time() + EMBED_LINGER
+                batch = []
+                while True:
+                    if item is None:
+                        finished = True
+                        break
+                    batch.append(item)
+                    remaining = deadline - loop.time()
+                    if len(batch) >= EMBED_BATCH_SIZE or remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if not batch:
+                    continue
+                
+                print(f"  Embedding {len(batch)} documents...")
+                locations = [location for location, _, _ in batch]
+                if await embed(locations):
+                    embedded += len(batch)
+                    for _, name, digest in batch:
+                        embedded_hashes[name] = digest
+                    print(f"  ✓ Embedded {len(batch)} documents")
+                else:
+                    print(f"  ✗ Embedding failed for {len(batch)} documents")
+        
+        try:
+            await asyncio.gather(produce(), consume())
+        finally:
+            save_json(manifest_path, manifest)
     
     # Summary
     print(f"\n{'='*50}")
     print("Upload Complete!")
     print(f"  - Documents uploaded: {uploaded}/{len(files)}")
     print(f"  - Documents embedded: {embedded}/{len(files)}")
+    print(f"  - Documents unchanged: {skipped}/{len(files)}")
     print(f"  - Workspace: {workspace_name}")
     print(f"{'='*50}")
 
 
+def upload_documents(
+    anythingllm_url: str,
+    api_key: str,
+    documents_dir: str,
+    workspace_name: str = "MediaWiki Import",
+    concurrency: int = 8
+):
+    """
+    Upload documents to AnythingLLM and embed them in a workspace.
+    
+    Args:
+        anythingllm_url: AnythingLLM server URL
+        api_key: API key for authentication
+        documents_dir: Directory containing documents to upload
+        workspace_name: Name of the workspace to use/create
+        concurrency: Maximum number of documents uploaded at once
+    """
+    event_loop.run(_upload_documents(
+        anythingllm_url,
+        api_key,
+        documents_dir,
+        workspace_name,
+        concurrency
+    ))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Upload documents to AnythingLLM'
@@ -227,6 +533,12 @@ def main():
         default='MediaWiki Import',
         help='Workspace name (default: MediaWiki Import)'
     )
+    parser.add_argument(
+        '--concurrency', '-c',
+        type=int,
+        default=8,
+        help='Maximum number of concurrent uploads (default: 8)'
+    )
     
     args = parser.parse_args()
     
@@ -250,7 +562,8 @@ def main():
         anythingllm_url=args.url,
         api_key=args.api_key,
         documents_dir=args.documents,
-        workspace_name=args.workspace
+        workspace_name=args.workspace,
+        concurrency=args.concurrency
     )
 
 